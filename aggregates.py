@@ -0,0 +1,174 @@
+# Precomputed aggregates over the cleaned dataset.
+#
+# Cohort ranges are answered from prefix sums: headcount is pivoted into one
+# row per cell (e.g. dept x urm x fresh x outcome) and one column per cohort,
+# then cumulatively summed across cohorts. The total for cohorts lo..hi is
+# prefix[hi] - prefix[lo - 1], i.e. two column lookups per cell however many
+# rows or cohorts the extract has.
+#
+# Rollups follow the hierarchy major -> department -> division -> campus.
+# Departments are sums of the major-grain prefix sums, so a double major counts
+# once per major. Divisions and campus are built from the primary row of each
+# original row instead, so every student is counted once there and those
+# levels are not the sum of the departments.
+import pandas as pd
+
+cell_keys = ['urm', 'fresh', 'outcome_display', 'division_outcome']
+
+rollup_levels = {
+    'campus': [],
+    'division': ['start_div'],
+    'department': ['start_div', 'start_dept'],
+    'major': ['start_div', 'start_dept', 'start_maj'],
+}
+
+
+def cohort_prefix_sums(df, keys):
+    """
+    Cumulative headcount per cell over consecutive cohorts
+
+    Returns a DataFrame indexed by keys with one column per cohort, plus a
+    leading all-zero column for the cohort before the first. Missing keys
+    (e.g. double majors with no start_dept) are kept as their own cells.
+    """
+    counts = df.groupby([*keys, 'cohort'], dropna=False)['headcount'].sum().unstack('cohort', fill_value=0)
+    first, last = counts.columns.min(), counts.columns.max()
+    counts = counts.reindex(columns=range(first, last + 1), fill_value=0)
+    prefix = counts.cumsum(axis=1)
+    prefix.insert(0, first - 1, 0)
+    return prefix
+
+
+def build_rollups(df):
+    """
+    Prefix sum tables for every level in rollup_levels
+
+    Major and department come from every row of the double-major expansion,
+    division and campus from the primary rows only.
+    """
+    prefix = cohort_prefix_sums(df, rollup_levels['major'] + cell_keys)
+    primary = cohort_prefix_sums(df[df['primary']], rollup_levels['division'] + cell_keys)
+    return {
+        level: (primary if level in ('division', 'campus') else prefix).groupby(level=grain + cell_keys, dropna=False).sum()
+        for level, grain in rollup_levels.items()
+    }
+
+
+def cohort_bounds(prefix):
+    """
+    First and last cohort covered by a prefix sum table
+    """
+    return int(prefix.columns[1]), int(prefix.columns[-1])
+
+
+def range_totals(prefix, start, end):
+    """
+    Headcount per cell for cohorts start..end (inclusive)
+    """
+    first, last = cohort_bounds(prefix)
+    start, end = max(start, first), min(end, last)
+    if start > end:
+        return pd.Series(0, index=prefix.index)
+    return prefix[end] - prefix[start - 1]
+
+
+def cohort_counts(prefix):
+    """
+    Headcount per cell and cohort, recovered from a prefix sum table
+    """
+    return prefix.diff(axis=1).iloc[:, 1:].astype(prefix.dtypes.iloc[0])
+
+
+def outcome_percentages(cells, outcome_level='outcome_display'):
+    """
+    Percentage of each outcome per cohort, from per-cohort cell counts
+
+    Cohorts with no students are dropped.
+    """
+    counts = cells.groupby(level=outcome_level).sum().T
+    totals = counts.sum(axis=1)
+    counts = counts[totals > 0]
+    return counts.div(totals[totals > 0], axis=0) * 100
+
+
+def select(cells, **levels):
+    """
+    Keep the cells whose index levels equal the given values, e.g. start_dept='math'
+    """
+    for level, value in levels.items():
+        cells = cells[cells.index.get_level_values(level) == value]
+    return cells
+
+
+def retention_by_group(counts, group_levels, retained_outcome='Stayed in Department', outcome_level='outcome_display'):
+    """
+    Retention rate per cohort for every combination of group_levels
+
+    counts: per-cohort cell counts, as returned by cohort_counts
+    All groups come out of a single groupby, so more series cost almost
+    nothing. Returns one row per group and one column per cohort, NaN where
+    a group has no students.
+    """
+    grouped = counts.groupby(level=[*group_levels, outcome_level]).sum()
+    totals = grouped.groupby(level=group_levels).sum()
+    retained = grouped[grouped.index.get_level_values(outcome_level) == retained_outcome] \
+        .droplevel(outcome_level) \
+        .reindex(totals.index, fill_value=0)
+    return (retained / totals * 100).where(totals > 0)
+
+
+def retention_gap(counts, level):
+    """
+    Department x cohort difference in retention rate between the True and
+    False values of a boolean level (urm: URM - Non-URM, fresh: Freshman - Transfer)
+
+    Both rates come from one retention_by_group pivot; NaN where either side
+    has no students, including when the extract has no rows for one side:
+
+    >>> cells = pd.MultiIndex.from_tuples(
+    ...     [('math', True, 'Stayed in Department'), ('math', True, 'No Degree')],
+    ...     names=['start_dept', 'fresh', 'outcome_display'])
+    >>> retention_gap(pd.DataFrame({2010: [1, 1]}, index=cells), 'fresh').to_dict()
+    {2010: {'math': nan}}
+    """
+    rates = retention_by_group(counts, ['start_dept', level])
+    rates = rates[rates.index.get_level_values('start_dept') != 'undeclared']
+    sides = rates.unstack(level)
+    sides = sides.reindex(columns=pd.MultiIndex.from_product([rates.columns, [True, False]], names=sides.columns.names))
+    return sides.xs(True, axis=1, level=level) - sides.xs(False, axis=1, level=level)
+
+
+def filter_cells(cells, urm_status, student_type):
+    """
+    Keep the cells matching the URM / student type dropdowns
+    """
+    if urm_status != 'All':
+        cells = cells[cells.index.get_level_values('urm') == (urm_status == 'URM')]
+    if student_type != 'All':
+        cells = cells[cells.index.get_level_values('fresh') == (student_type == 'Freshman')]
+    return cells
+
+
+def retention_totals(cells, retained_outcome, outcome_level='outcome_display'):
+    """
+    Total headcount and retention rate over all the given cells
+    """
+    total = cells.sum()
+    retained = cells[cells.index.get_level_values(outcome_level) == retained_outcome].sum()
+    retention_rate = (retained / total * 100) if total > 0 else 0
+    return total, retention_rate
+
+
+def retention_summary(cells, retained_outcome, level='start_dept', outcome_level='outcome_display'):
+    """
+    Total headcount and retention rate per value of level
+
+    cells: range totals, as returned by range_totals (optionally filtered)
+    retained_outcome: value of outcome_level that counts as retained
+    """
+    total = cells.groupby(level=level).sum()
+    retained = cells[cells.index.get_level_values(outcome_level) == retained_outcome] \
+        .groupby(level=level).sum() \
+        .reindex(total.index, fill_value=0)
+    rate = (retained / total * 100).where(total > 0, 0)
+    return pd.DataFrame({'retention_rate': rate, 'total': total})
@@ -1,101 +1,274 @@
+import functools
+import os
+import time
+
 import streamlit as st
-import pandas as pd
-import plotly.graph_objects as go
+
+import aggregates
+import charts
+import exports
+import metrics
+import pipeline
+import reactive
+
+rerun_start = time.perf_counter()
 
 # Page config
 st.set_page_config(page_title="UCLA Physical Sciences Retention", layout="wide")
+metrics.serve()
+# Set on every run, so reloads of pipeline.py or metrics.py keep the stage metrics wired up
+pipeline.stage_listeners['metrics'] = metrics.observe_stage
+
+# Every extract in raw_data.csv / data/*.csv is a dataset; stale ones are
+# cleaned concurrently before anything is read
+@st.cache_data(max_entries=64)
+def check_dataset(raw_path, cleaned_mtime):
+    # Rechecked only when the cleaned file changes
+    return pipeline.check_cleaned(raw_path)
+
+raw_paths = pipeline.discover_raw()
+with st.spinner("Preparing datasets..."):
+    failed = pipeline.build_stale(raw_paths)
+
+# Extracts that parsed but are too narrow for the dashboard are left out too
+for path in raw_paths:
+    if path not in failed:
+        problem = check_dataset(path, os.path.getmtime(pipeline.cleaned_path_for(path)))
+        if problem:
+            failed[path] = problem
+
+# A broken extract is left out rather than taking the dashboard down
+for path, error in failed.items():
+    st.warning(f"Skipping dataset {pipeline.dataset_name(path)}: {error}")
+raw_paths = [p for p in raw_paths if p not in failed]
+if not raw_paths:
+    st.error("No dataset could be loaded.")
+    st.stop()
+
+raw_path = raw_paths[0]
+if len(raw_paths) > 1:
+    raw_path = st.sidebar.selectbox('Dataset', options=raw_paths, format_func=pipeline.dataset_name, key='dataset')
+
+# Cache entries are keyed by dataset and the cleaned file's mtime, so a rebuilt
+# extract gets fresh entries and entries for datasets nobody has picked lately
+# are evicted instead of piling up in memory
+dataset_version = (raw_path, os.path.getmtime(pipeline.cleaned_path_for(raw_path)))
 
 # Load and process data
-@st.cache_data
-def load_data():
-    maj2dept = {
-        'atmospheric and oceanic sciences': 'aos',
-        'climate science': 'aos',
-        'aos/math': 'aos',
-        'biochemistry': 'chemistry and biochemistry',
-        'chemistry': 'chemistry and biochemistry',
-        'materials science': 'chemistry and biochemistry',
-        'gen chem for teaching': 'chemistry and biochemistry',
-        'geology': 'epss',
-        'engineering geology': 'epss',
-        'geophysics': 'epss',
-        'earth and environmental science': 'epss',
-        'mathematics': 'math',
-        'applied mathematics': 'math',
-        'financial actuarial mathematics': 'math',
-        'mathematics applied science': 'math',
-        'mathematics of computation': 'math',
-        'mathematics for teaching': 'math',
-        'mathematics/economics': 'math',
-        'astrophysics': 'physics and astronomy',
-        'biophysics': 'physics and astronomy',
-        'physics': 'physics and astronomy',
-        'physics-ba': 'physics and astronomy',
-        'statistics and data science': 'statistics',
-        'data theory': 'statistics',
-        'environmental science': 'institute of environment and sustainability',
-    }
+@st.cache_data(max_entries=4, ttl=3600)
+def load_data(dataset_version):
+    # Reads the prebuilt <raw>_cleaned.parquet (see cli.py build), rebuilding it when the raw extract is newer
+    metrics.record_miss('load_data')
+    df = pipeline.load_cleaned(dataset_version[0])
+    metrics.dataset_rows.labels(pipeline.dataset_name(dataset_version[0])).set(len(df))
+    return df
 
-    special_cases = {'no degree': 'no degree', 'undeclared': 'undeclared'}
-    maj2dept_and_friends = maj2dept | special_cases
-
-    df = pd.read_csv("raw_data.csv")
-
-    # Data cleaning
-    df.rename(columns={'cohort_major_desc': 'start_maj', 'deg_major_desc': 'end_maj', 'freshman_transfer': 'fresh'}, inplace=True)
-    for col in ['urm', 'fresh', 'start_maj', 'end_maj']:
-        df[col] = df[col].str.strip().str.lower()
-    df['cohort'] = df['cohort'].str[:4].astype(int)
-    df['urm'] = df['urm'].map({'urm': True, 'non-urm': False})
-    df['fresh'] = df['fresh'].map({'freshman': True, 'transfer': False})
-    df['start_maj'] = df['start_maj'] \
-        .replace('general chemistry', 'chemistry') \
-        .replace('undeclared-physical science', 'undeclared') \
-        .replace('mathematics/applied science', 'mathematics applied science') # get rid of slash so it isnt treated like a double major
+@st.cache_data(max_entries=4, ttl=3600)
+def load_rollups(dataset_version):
+    # Prefix sums per cohort at major, department, division and campus level
+    metrics.record_miss('load_rollups')
+    df = metrics.cached_call('load_data', load_data, dataset_version)
+    with metrics.load_seconds.labels('rollups').time():
+        return aggregates.build_rollups(df)
+
+@st.cache_data(max_entries=4, ttl=3600)
+def load_cohort_counts(dataset_version):
+    # Headcount per department cell and cohort, shared by the comparison and gap tabs
+    metrics.record_miss('load_cohort_counts')
+    rollups = metrics.cached_call('load_rollups', load_rollups, dataset_version)
+    with metrics.load_seconds.labels('counts').time():
+        return aggregates.cohort_counts(rollups['department'])
+
+@st.cache_data(max_entries=4, ttl=3600)
+def load_retention_gaps(dataset_version):
+    # Department x cohort gaps: URM - Non-URM and Freshman - Transfer
+    metrics.record_miss('load_retention_gaps')
+    counts = metrics.cached_call('load_cohort_counts', load_cohort_counts, dataset_version)
+    with metrics.load_seconds.labels('gaps').time():
+        return {level: aggregates.retention_gap(counts, level) for level in ['urm', 'fresh']}
+
+rollups = metrics.cached_call('load_rollups', load_rollups, dataset_version)
+cohort_index = rollups['department']
+
+# Widgets whose options come from the data start over when the dataset changes
+if st.session_state.get('loaded_dataset', raw_path) != raw_path:
+    for key in ['dept_tab1', 'major_tab1', 'depts_tab4', 'cohort_range']:
+        st.session_state.pop(key, None)
+st.session_state['loaded_dataset'] = raw_path
+
+# Computations, declared with the widgets they read. On a rerun only the nodes
+# whose widgets (or upstream nodes) changed are recomputed; the rest are reused
+# from this session's previous rerun.
+graph = reactive.Graph(st.session_state, data_key=dataset_version)
+
+def range_label(cohort_range):
+    return f"{cohort_range[0]}-{cohort_range[1]} Cohorts"
+
+@graph.node()
+def departments():
+    return sorted([d for d in cohort_index.index.get_level_values('start_dept').dropna().unique() if d != 'undeclared'])
+
+@graph.node(widgets=['dept_tab1'])
+def majors(dept_tab1):
+    return sorted(aggregates.select(rollups['major'], start_dept=dept_tab1).index.get_level_values('start_maj').unique())
+
+@graph.node(widgets=['dept_tab1', 'major_tab1', 'urm_tab1', 'student_tab1'])
+def tab1_cells(dept_tab1, major_tab1, urm_tab1, student_tab1):
+    # Select cells from the rollups
+    if major_tab1 == 'All':
+        selected = aggregates.select(cohort_index, start_dept=dept_tab1)
+    else:
+        selected = aggregates.select(rollups['major'], start_dept=dept_tab1, start_maj=major_tab1)
+    return aggregates.filter_cells(selected, urm_tab1, student_tab1)
+
+@graph.node(deps=['tab1_cells'])
+def tab1_percentages(tab1_cells):
+    # Percentages per cohort
+    return aggregates.outcome_percentages(aggregates.cohort_counts(tab1_cells))
+
+@graph.node(widgets=['dept_tab1', 'major_tab1', 'urm_tab1', 'student_tab1'], deps=['tab1_percentages'])
+def tab1_figure(dept_tab1, major_tab1, urm_tab1, student_tab1, tab1_percentages):
+    pivot = tab1_percentages
+    
+    title = f'Student Outcomes for {dept_tab1.title()} Department'
+    if major_tab1 != 'All':
+        title = f'Student Outcomes for {major_tab1.title()} ({dept_tab1.title()} Department)'
+    title = charts.filter_title(title, urm_tab1, student_tab1)
+    return charts.outcome_area_figure(pivot.index, pivot, charts.dept_outcomes, title)
+
+@graph.node(widgets=['cohort_range'], deps=['tab1_cells'])
+def tab1_summary(cohort_range, tab1_cells):
+    cells = aggregates.range_totals(tab1_cells, *cohort_range)
+    return aggregates.retention_totals(cells, 'Stayed in Department')
+
+@graph.node(widgets=['urm_tab2', 'student_tab2', 'cohort_range'])
+def tab2_retention(urm_tab2, student_tab2, cohort_range):
+    # Totals for the cohort range, from the prefix sums
+    cells = aggregates.range_totals(cohort_index, *cohort_range)
+    cells = aggregates.filter_cells(cells, urm_tab2, student_tab2)
+    cells = cells[cells.index.get_level_values('start_dept') != 'undeclared']
     
-    df['end_maj'] = df['end_maj'] \
-        .replace('mathematics/applied science', 'mathematics applied science')
-
-    # Track depts
-    df['start_dept'] = df['start_maj'].map(maj2dept_and_friends)
-
-    def temp_maj2dept_mapper_that_handles_other_divs(maj):
-        return maj2dept_and_friends.get(maj, 'other')
-
-    df['end_dept'] = df['end_maj'].map(temp_maj2dept_mapper_that_handles_other_divs)
+    # Calculate retention per department
+    retention_df = aggregates.retention_summary(cells, 'Stayed in Department')
+    retention_df = retention_df[retention_df['total'] > 0].rename_axis('dept').reset_index()
+    return retention_df.sort_values('retention_rate', ascending=True)
+
+@graph.node(widgets=['urm_tab2', 'student_tab2', 'cohort_range'], deps=['tab2_retention'])
+def tab2_figure(urm_tab2, student_tab2, cohort_range, tab2_retention):
+    title = charts.filter_title(f"Average Department Retention Rates ({range_label(cohort_range)})", urm_tab2, student_tab2)
+    return charts.retention_bar_figure(tab2_retention['dept'], tab2_retention['retention_rate'], tab2_retention['total'], title)
+
+@graph.node(widgets=['urm_tab2', 'student_tab2', 'cohort_range'])
+def division_summary(urm_tab2, student_tab2, cohort_range):
+    # Division-wide context, including undeclared students
+    division = aggregates.range_totals(rollups['division'], *cohort_range)
+    division = aggregates.filter_cells(division, urm_tab2, student_tab2)
+    return aggregates.retention_totals(division, 'Stayed in Physical Sciences', 'division_outcome')
+
+@graph.node()
+def undeclared_cells():
+    return aggregates.select(cohort_index, start_dept='undeclared')
+
+@graph.node(deps=['undeclared_cells'])
+def undeclared_percentages(undeclared_cells):
+    return aggregates.outcome_percentages(aggregates.cohort_counts(undeclared_cells), 'division_outcome')
+
+@graph.node(deps=['undeclared_percentages'])
+def undeclared_figure(undeclared_percentages):
+    pivot = undeclared_percentages
+    return charts.outcome_area_figure(pivot.index, pivot, charts.undeclared_outcomes, 'Undeclared Student Outcomes')
+
+@graph.node(widgets=['cohort_range'], deps=['undeclared_cells'])
+def undeclared_summary(cohort_range, undeclared_cells):
+    cells = aggregates.range_totals(undeclared_cells, *cohort_range)
+    return aggregates.retention_totals(cells, 'Stayed in Physical Sciences', 'division_outcome')
+
+@graph.node(widgets=['depts_tab4', 'split_tab4'])
+def comparison_rates(depts_tab4, split_tab4):
+    slice_levels = {'URM Status': 'urm', 'Student Type': 'fresh'}
+    slice_labels = {'urm': {True: 'URM', False: 'Non-URM'}, 'fresh': {True: 'Freshman', False: 'Transfer'}}
+    group_levels = ['start_dept'] + [slice_levels[s] for s in split_tab4]
+
+    # Every series comes from one groupby over the selected departments' cells
+    counts = metrics.cached_call('load_cohort_counts', load_cohort_counts, dataset_version)
+    counts = counts[counts.index.get_level_values('start_dept').isin(depts_tab4)]
+    rates = aggregates.retention_by_group(counts, group_levels)
+
+    labels = []
+    for group in rates.index:
+        group = group if isinstance(group, tuple) else (group,)
+        parts = [group[0].title()] + [slice_labels[level][value] for level, value in zip(group_levels[1:], group[1:])]
+        labels.append(' · '.join(parts))
+
+    return rates.set_axis(labels).rename_axis('group')
+
+@graph.node(deps=['comparison_rates'])
+def comparison_figure(comparison_rates):
+    series = dict(comparison_rates.iterrows())
+    return charts.comparison_figure(comparison_rates.columns, series, 'Retention Rate by Group')
+
+@graph.node(widgets=['cohort_range'])
+def gap_tables(cohort_range):
+    gaps = metrics.cached_call('load_retention_gaps', load_retention_gaps, dataset_version)
+    return {level: gap.loc[:, cohort_range[0]:cohort_range[1]] for level, gap in gaps.items()}
+
+@graph.node(deps=['gap_tables'])
+def gap_figures(gap_tables):
+    gap_titles = {
+        'urm': ('URM − Non-URM Retention Gap', 'URM − Non-URM'),
+        'fresh': ('Freshman − Transfer Retention Gap', 'Freshman − Transfer'),
+    }
 
-    def categorize_outcome(row):
-        if row['end_dept'] == 'no degree':
-            return 'no degree'
-        if row['end_dept'] == row['start_dept']:
-            return 'retained'
-        else:
-            return 'other degree'
-    
-    df['outcome'] = df.apply(categorize_outcome, axis=1)
-
-    # Expand double majors
-    def expand_double_majors(df):
-        expanded_rows = []
-        
-        for _, row in df.iterrows():
-            start_majors = row['start_maj'].split('/') if '/' in str(row['start_maj']) else [row['start_maj']]
-            end_majors = row['end_maj'].split('/') if '/' in str(row['end_maj']) and pd.notna(row['end_maj']) else [row['end_maj']]
-            
-            for start_maj in start_majors:
-                for end_maj in end_majors:
-                    new_row = row.copy()
-                    new_row['start_maj'] = start_maj.strip()
-                    new_row['end_maj'] = end_maj.strip() if pd.notna(end_maj) else end_maj
-                    expanded_rows.append(new_row)
-        
-        return pd.DataFrame(expanded_rows)
-
-    df = expand_double_majors(df)
-    
-    return df
+    figures = {}
+    for level, (title, colorbar_title) in gap_titles.items():
+        gap = gap_tables[level]
+        figures[level] = charts.gap_heatmap_figure(gap.columns, gap.index, gap.values, title, colorbar_title)
+    return figures
+
+# Tab and kind each node's build time is reported under
+node_tabs = {
+    'departments': ('outcomes', 'aggregation'),
+    'majors': ('outcomes', 'aggregation'),
+    'tab1_cells': ('outcomes', 'aggregation'),
+    'tab1_percentages': ('outcomes', 'aggregation'),
+    'tab1_figure': ('outcomes', 'figure'),
+    'tab1_summary': ('outcomes', 'aggregation'),
+    'tab2_retention': ('retention', 'aggregation'),
+    'tab2_figure': ('retention', 'figure'),
+    'division_summary': ('retention', 'aggregation'),
+    'undeclared_cells': ('undeclared', 'aggregation'),
+    'undeclared_percentages': ('undeclared', 'aggregation'),
+    'undeclared_figure': ('undeclared', 'figure'),
+    'undeclared_summary': ('undeclared', 'aggregation'),
+    'comparison_rates': ('comparison', 'aggregation'),
+    'comparison_figure': ('comparison', 'figure'),
+    'gap_tables': ('gaps', 'aggregation'),
+    'gap_figures': ('gaps', 'figure'),
+}
+
+# Serialized figures sent this rerun, for the payload report in the sidebar
+chart_specs = {}
+
+def plot(fig, name):
+    chart_specs[name] = charts.to_json(fig)
+    st.plotly_chart(fig, use_container_width=True)
 
-df = load_data()
+def download_buttons(table, name):
+    # CSV and Parquet buttons for a table; the file is only generated when clicked
+    cols = st.columns(len(exports.formats))
+    for col, (fmt, mime) in zip(cols, exports.formats.items()):
+        col.download_button(
+            f"Download {fmt.upper()}",
+            data=functools.partial(exports.to_bytes, table, fmt),
+            file_name=f"{name}.{fmt}",
+            mime=mime,
+            key=f"download_{name}_{fmt}",
+            on_click='ignore',
+        )
+
+def cohort_table(table, index_name):
+    # Wide table with one column per cohort, as a flat frame with string column names
+    return table.rename(columns=str).rename_axis(index_name).reset_index()
 
 # Header
 st.title("📊 UCLA Physical Sciences Retention Analysis")
@@ -124,298 +297,146 @@ with st.expander("ℹ️ Methodological Notes"):
 
 st.markdown("---")
 
+# Cohort range used by the summary statistics and the retention comparison
+first_cohort, last_cohort = aggregates.cohort_bounds(cohort_index)
+if first_cohort < last_cohort:
+    # Default to 2010-2020, clamped so it stays inside the data's cohorts
+    default_start = min(max(2010, first_cohort), last_cohort)
+    default_end = max(min(2020, last_cohort), default_start)
+    cohort_range = st.slider(
+        'Cohort Range',
+        min_value=first_cohort,
+        max_value=last_cohort,
+        value=(default_start, default_end),
+        key='cohort_range',
+    )
+else:
+    # st.slider needs min < max; a single-cohort extract has nothing to choose
+    cohort_range = (first_cohort, last_cohort)
+    st.session_state['cohort_range'] = cohort_range
+cohort_range_label = range_label(cohort_range)
+
 # Tab selection
-tab1, tab2, tab3 = st.tabs(["📈 Per-Department Outcomes Over Time", "📊 Department Retention Comparison", "👤 Undeclared Outcomes"])
+tab1, tab2, tab3, tab4, tab5 = st.tabs(["📈 Per-Department Outcomes Over Time", "📊 Department Retention Comparison", "👤 Undeclared Outcomes", "🔀 Group Comparison", "🌡️ Retention Gaps"])
 
 # TAB 1: Per-Department Outcomes
 with tab1:
     st.subheader("Student Outcomes by Department Over Time")
     
-    col1, col2, col3 = st.columns(3)
-
-    departments = sorted([d for d in df['start_dept'].dropna().unique() if d != 'undeclared'])
+    col1, col2, col3, col4 = st.columns(4)
     
     with col1:
-        department = st.selectbox('Select Department', options=departments, index=0, key='dept_tab1')
+        st.selectbox('Select Department', options=graph['departments'], index=0, key='dept_tab1')
     
+    # Drill down from the department to one of its majors
     with col2:
-        urm_status = st.selectbox('URM Status', options=['All', 'URM', 'Non-URM'], index=0, key='urm_tab1')
+        st.selectbox('Major', options=['All'] + graph['majors'], index=0, key='major_tab1')
     
     with col3:
-        student_type = st.selectbox('Student Type', options=['All', 'Freshman', 'Transfer'], index=0, key='student_tab1')
-    
-    # Filter data
-    def categorize_outcome_display(row):
-        if row['end_dept'] == 'no degree':
-            return 'No Degree'
-        elif row['start_dept'] == row['end_dept']:
-            return 'Stayed in Department'
-        else:
-            return 'Other Department'
-    
-    df['outcome_display'] = df.apply(categorize_outcome_display, axis=1)
-    
-    filtered = df[df['start_dept'] == department].copy()
-    
-    if urm_status != 'All':
-        filtered = filtered[filtered['urm'] == (urm_status == 'URM')]
+        st.selectbox('URM Status', options=['All', 'URM', 'Non-URM'], index=0, key='urm_tab1')
     
-    if student_type != 'All':
-        filtered = filtered[filtered['fresh'] == (student_type == 'Freshman')]
+    with col4:
+        st.selectbox('Student Type', options=['All', 'Freshman', 'Transfer'], index=0, key='student_tab1')
     
-    # Group and calculate percentages
-    grouped = filtered.groupby(['cohort', 'outcome_display'])['headcount'].sum().reset_index()
-    totals = filtered.groupby('cohort')['headcount'].sum().reset_index()
-    totals.rename(columns={'headcount': 'total'}, inplace=True)
-    
-    grouped = grouped.merge(totals, on='cohort')
-    grouped['percentage'] = (grouped['headcount'] / grouped['total']) * 100
-    
-    # Pivot
-    pivot = grouped.pivot(index='cohort', columns='outcome_display', values='percentage').fillna(0)
-    
-    # Create figure
-    fig1 = go.Figure()
-    
-    outcomes = ['Stayed in Department', 'Other Department', 'No Degree']
-    colors = ['#268bd2', '#859900', '#dc322f']
-    
-    for i, outcome in enumerate(outcomes):
-        if outcome in pivot.columns:
-            fig1.add_trace(go.Scatter(
-                x=pivot.index,
-                y=pivot[outcome],
-                name=outcome,
-                stackgroup='one',
-                fillcolor=colors[i],
-                line=dict(width=0.5, color=colors[i]),
-                hovertemplate='%{y:.1f}%<extra></extra>'
-            ))
-    
-    # Update layout
-    title = f'Student Outcomes for {department.title()} Department'
-    if urm_status != 'All':
-        title += f' ({urm_status})'
-    if student_type != 'All':
-        title += f' ({student_type})'
-    
-    fig1.update_layout(
-        title=title,
-        xaxis_title='Cohort Year',
-        yaxis_title='Percentage (%)',
-        hovermode='x unified',
-        height=500,
-        yaxis=dict(range=[0, 100]),
-        xaxis=dict(tickmode='linear', tick0=2010, dtick=1),
-        legend=dict(
-            orientation="h",
-            yanchor="bottom",
-            y=-0.3,
-            xanchor="center",
-            x=0.5
-        ),
-        shapes=[
-            dict(
-                type='line',
-                x0=2020,
-                x1=2020,
-                y0=0,
-                y1=100,
-                line=dict(color='#657b83', width=2, dash='dash'),
-                opacity=0.5
-            )
-        ]
-    )
-    
-    st.plotly_chart(fig1, use_container_width=True)
+    plot(graph['tab1_figure'], 'outcomes')
+    download_buttons(graph['tab1_percentages'].rename_axis('cohort').reset_index(), 'outcomes')
     
     # Summary stats
-    st.subheader("Summary Statistics (2010-2020 Cohorts)")
+    st.subheader(f"Summary Statistics ({cohort_range_label})")
     scol1, scol2 = st.columns(2)
     
-    filtered_cohorts = filtered[(filtered['cohort'] >= 2010) & (filtered['cohort'] <= 2020)]
-    total_students = filtered_cohorts['headcount'].sum()
-    retained = filtered_cohorts[filtered_cohorts['outcome_display'] == 'Stayed in Department']['headcount'].sum()
-    retention_rate = (retained / total_students * 100) if total_students > 0 else 0
+    total_students, retention_rate = graph['tab1_summary']
     
     scol1.metric("Total Students", f"{int(total_students)}")
     scol2.metric("Retention Rate", f"{retention_rate:.1f}%")
 
 # TAB 2: Retention Comparison
 with tab2:
-    st.subheader("Average Department Retention Rates (2010-2020 Cohorts)")
+    st.subheader(f"Average Department Retention Rates ({cohort_range_label})")
     
     col1, col2 = st.columns(2)
     
     with col1:
-        urm_status_2 = st.selectbox('URM Status', options=['All', 'URM', 'Non-URM'], index=0, key='urm_tab2')
+        st.selectbox('URM Status', options=['All', 'URM', 'Non-URM'], index=0, key='urm_tab2')
     
     with col2:
-        student_type_2 = st.selectbox('Student Type', options=['All', 'Freshman', 'Transfer'], index=0, key='student_tab2')
-    
-    # Filter cohort range
-    df_filtered = df[(df['cohort'] >= 2010) & (df['cohort'] <= 2020)].copy()
-    
-    # Apply filters
-    if urm_status_2 != 'All':
-        df_filtered = df_filtered[df_filtered['urm'] == (urm_status_2 == 'URM')]
-    
-    if student_type_2 != 'All':
-        df_filtered = df_filtered[df_filtered['fresh'] == (student_type_2 == 'Freshman')]
-    
-    # Calculate retention per department
-    retention_rates = []
+        st.selectbox('Student Type', options=['All', 'Freshman', 'Transfer'], index=0, key='student_tab2')
     
-    departments_list = sorted([d for d in df_filtered['start_dept'].dropna().unique() if d != 'undeclared'])
+    plot(graph['tab2_figure'], 'retention')
+    download_buttons(graph['tab2_retention'], 'retention')
     
-    for dept in departments_list:
-        dept_df = df_filtered[df_filtered['start_dept'] == dept]
-        
-        total = dept_df['headcount'].sum()
-        retained = dept_df[dept_df['outcome_display'] == 'Stayed in Department']['headcount'].sum()
-        
-        retention_rate = (retained / total * 100) if total > 0 else 0
-        
-        retention_rates.append({
-            'dept': dept,
-            'retention_rate': retention_rate,
-            'total': total
-        })
+    total_students, stayed_rate = graph['division_summary']
     
-    retention_df = pd.DataFrame(retention_rates).dropna()
-    retention_df = retention_df.sort_values('retention_rate', ascending=True)
-    
-    # Create Plotly figure
-    fig2 = go.Figure()
-    
-    fig2.add_trace(go.Bar(
-        x=retention_df['retention_rate'],
-        y=retention_df['dept'].str.title(),
-        orientation='h',
-        text=[f"{v:.1f}%" for v in retention_df['retention_rate']],
-        textposition='outside',
-        marker=dict(color='#2E86AB'),
-        hovertemplate=(
-            "<b>%{y}</b><br>"
-            "Retention: %{x:.1f}%<br>"
-            "Total students: %{customdata}<extra></extra>"
-        ),
-        customdata=retention_df['total']
-    ))
-    
-    # Dynamic title
-    title = "Average Department Retention Rates (2010–2020 Cohorts)"
-    if urm_status_2 != 'All':
-        title += f" ({urm_status_2})"
-    if student_type_2 != 'All':
-        title += f" ({student_type_2})"
-    
-    fig2.update_layout(
-        title=title,
-        xaxis_title='Retention Rate (%)',
-        yaxis_title='Department',
-        xaxis=dict(range=[0, 100]),
-        height=600,
-        margin=dict(l=200, r=40, t=80, b=60),
-        template='plotly_white'
-    )
-    
-    st.plotly_chart(fig2, use_container_width=True)
+    dcol1, dcol2 = st.columns(2)
+    dcol1.metric("Physical Sciences Students", f"{int(total_students)}")
+    dcol2.metric("Graduated in Physical Sciences", f"{stayed_rate:.1f}%")
 
 with tab3:
     st.subheader("Undeclared Student Outcomes")
 
-    # Define physical sciences departments
-    phys_sci_depts = {'aos', 'chemistry and biochemistry', 'epss', 
-                    'institute of environment and sustainability', 'math', 
-                    'physics and astronomy', 'statistics'}
-
-    # Filter for undeclared students
-    undeclared = df[df['start_dept'] == 'undeclared'].copy()
-
-    # Categorize outcomes
-    def categorize_undeclared_outcome(row):
-        if row['end_dept'] == 'no degree':
-            return 'No Degree'
-        elif row['end_dept'] in phys_sci_depts:
-            return 'Stayed in Physical Sciences'
-        else:
-            return 'Other Degree'
-
-    undeclared['outcome'] = undeclared.apply(categorize_undeclared_outcome, axis=1)
-
-    # Group and calculate percentages
-    grouped = undeclared.groupby(['cohort', 'outcome'])['headcount'].sum().reset_index()
-    totals = undeclared.groupby('cohort')['headcount'].sum().reset_index()
-    totals.rename(columns={'headcount': 'total'}, inplace=True)
-
-    grouped = grouped.merge(totals, on='cohort')
-    grouped['percentage'] = (grouped['headcount'] / grouped['total']) * 100
-
-    # Pivot
-    pivot = grouped.pivot(index='cohort', columns='outcome', values='percentage').fillna(0)
-
-    # Create figure
-    fig = go.Figure()
-
-    outcomes = ['Stayed in Physical Sciences', 'Other Degree', 'No Degree']
-    colors = ['#268bd2', '#859900', '#dc322f']
-
-    for i, outcome in enumerate(outcomes):
-        if outcome in pivot.columns:
-            fig.add_trace(go.Scatter(
-                x=pivot.index,
-                y=pivot[outcome],
-                name=outcome,
-                stackgroup='one',
-                fillcolor=colors[i],
-                line=dict(width=0.5, color=colors[i]),
-                hovertemplate='%{y:.1f}%<extra></extra>'
-            ))
-
-    fig.update_layout(
-        title='Undeclared Student Outcomes',
-        xaxis_title='Cohort Year',
-        yaxis_title='Percentage (%)',
-        hovermode='x unified',
-        height=500,
-        yaxis=dict(range=[0, 100]),
-        xaxis=dict(tickmode='linear', tick0=2010, dtick=1),
-        legend=dict(
-            orientation="h",
-            yanchor="bottom",
-            y=-0.3,
-            xanchor="center",
-            x=0.5
-        ),
-        shapes=[
-            dict(
-                type='line',
-                x0=2020,
-                x1=2020,
-                y0=0,
-                y1=100,
-                line=dict(color='#657b83', width=2, dash='dash'),
-                opacity=0.5
-            )
-        ]
-    )
-
-    st.plotly_chart(fig, use_container_width=True)
+    plot(graph['undeclared_figure'], 'undeclared')
+    download_buttons(graph['undeclared_percentages'].rename_axis('cohort').reset_index(), 'undeclared')
 
     # Summary stats
-    st.subheader("Summary Statistics (2010-2020 Cohorts)")
+    st.subheader(f"Summary Statistics ({cohort_range_label})")
     scol1, scol2 = st.columns(2)
 
-    filtered_cohorts = undeclared[(undeclared['cohort'] >= 2010) & (undeclared['cohort'] <= 2020)]
-    total_students = filtered_cohorts['headcount'].sum()
-    stayed = filtered_cohorts[filtered_cohorts['outcome'] == 'Stayed in Physical Sciences']['headcount'].sum()
-    retention_rate = (stayed / total_students * 100) if total_students > 0 else 0
+    total_students, retention_rate = graph['undeclared_summary']
 
     scol1.metric("Total Undeclared Students", f"{int(total_students)}")
     scol2.metric("Stayed in Physical Sciences", f"{retention_rate:.1f}%")
 
+# TAB 4: Overlay several departments x demographic slices
+with tab4:
+    st.subheader("Retention Over Time by Group")
+
+    col1, col2 = st.columns(2)
+
+    with col1:
+        st.multiselect('Departments', options=graph['departments'], default=graph['departments'][:2], key='depts_tab4')
+
+    with col2:
+        st.multiselect('Split By', options=['URM Status', 'Student Type'], default=['URM Status'], key='split_tab4')
+
+    plot(graph['comparison_figure'], 'comparison')
+    download_buttons(cohort_table(graph['comparison_rates'], 'group'), 'comparison')
+
+# TAB 5: Retention gaps for every department and cohort at once
+with tab5:
+    st.subheader(f"Retention Gaps by Department and Cohort ({cohort_range_label})")
+    st.markdown("Percentage-point difference in department retention. Red cells mean the first group is retained less often.")
+
+    for level, fig5 in graph['gap_figures'].items():
+        plot(fig5, f'gap_{level}')
+        download_buttons(cohort_table(graph['gap_tables'][level], 'dept'), f'gap_{level}')
+
 
 # Footer
 st.markdown("---")
 st.markdown("*Data source: UCLA Division of Physical Sciences*")
+
+# Chart payload sent by this rerun, and how much of it changed since the last one
+previous_specs = st.session_state.get('chart_spec_hashes', {})
+spec_hashes = {name: hash(spec) for name, spec in chart_specs.items()}
+sent_bytes = sum(len(spec) for spec in chart_specs.values())
+changed_bytes = sum(len(spec) for name, spec in chart_specs.items() if previous_specs.get(name) != spec_hashes[name])
+st.session_state['chart_spec_hashes'] = spec_hashes
+
+# Every major, cell and cohort of the selected dataset, built on disk on first click
+with st.sidebar.expander("Full campus export"):
+    for fmt, mime in exports.formats.items():
+        st.download_button(
+            f"Download {fmt.upper()}",
+            data=functools.partial(exports.campus_bytes, rollups['major'], raw_path, fmt),
+            file_name=f"{pipeline.dataset_name(raw_path)}_campus.{fmt}",
+            mime=mime,
+            key=f"download_campus_{fmt}",
+            on_click='ignore',
+        )
+
+with st.sidebar.expander("Diagnostics"):
+    st.caption(f"Chart payload this rerun: {sent_bytes / 1024:.1f} KB ({changed_bytes / 1024:.1f} KB changed)")
+    st.caption(f"Recomputed: {', '.join(graph.recomputed) or 'nothing'}")
+
+metrics.observe_graph(graph, node_tabs)
+metrics.rerun_seconds.observe(time.perf_counter() - rerun_start)
@@ -0,0 +1,170 @@
+# Plotly figure builders shared by app.py and cli.py.
+# They take plain sequences so callers don't need pandas.
+#
+# Every figure is sent to the browser as JSON on each rerun, so the builders
+# keep that payload small: the static skeleton (axes, legend, the dashed 2020
+# line) lives in a small shared template instead of plotly's default template
+# (~7 KB per figure), and data is rounded to display precision.
+import plotly.graph_objects as go
+import plotly.io as pio
+
+colors = ['#268bd2', '#859900', '#dc322f']
+dept_outcomes = ['Stayed in Department', 'Other Department', 'No Degree']
+undeclared_outcomes = ['Stayed in Physical Sciences', 'Other Degree', 'No Degree']
+
+# Hover labels show one decimal; two keeps stacked areas summing to 100
+precision = 2
+
+cohort_template = go.layout.Template(layout=dict(
+    xaxis=dict(title='Cohort Year', tickmode='linear', tick0=2010, dtick=1),
+    yaxis=dict(title='Percentage (%)', range=[0, 100]),
+    hovermode='x unified',
+    height=500,
+    legend=dict(
+        orientation="h",
+        yanchor="bottom",
+        y=-0.3,
+        xanchor="center",
+        x=0.5
+    ),
+    shapes=[
+        dict(
+            type='line',
+            x0=2020,
+            x1=2020,
+            y0=0,
+            y1=100,
+            line=dict(color='#657b83', width=2, dash='dash'),
+            opacity=0.5
+        )
+    ]
+))
+
+bar_template = go.layout.Template(layout=dict(
+    xaxis=dict(title='Retention Rate (%)', range=[0, 100]),
+    yaxis=dict(title='Department'),
+    height=600,
+    margin=dict(l=200, r=40, t=80, b=60),
+    plot_bgcolor='white',
+))
+
+heatmap_template = go.layout.Template(layout=dict(
+    xaxis=dict(title='Cohort Year', tickmode='linear', dtick=1),
+    yaxis=dict(title='Department', autorange='reversed'),
+    height=450,
+    margin=dict(l=200, r=40, t=80, b=60),
+))
+
+
+def rounded(values):
+    return [round(float(v), precision) for v in values]
+
+
+def filter_title(title, urm_status, student_type):
+    """
+    Append the active URM / student type filters to a chart title
+    """
+    if urm_status != 'All':
+        title += f' ({urm_status})'
+    if student_type != 'All':
+        title += f' ({student_type})'
+    return title
+
+
+def outcome_area_figure(cohorts, percentages, outcomes, title):
+    """
+    Stacked area chart of outcome percentages per cohort
+
+    cohorts: cohort years for the x axis
+    percentages: dict of outcome -> percentages aligned with cohorts
+    outcomes: outcomes to stack, in order
+    """
+    fig = go.Figure(layout=dict(template=cohort_template, title=title))
+
+    for i, outcome in enumerate(outcomes):
+        if outcome in percentages:
+            fig.add_trace(go.Scatter(
+                x=[int(c) for c in cohorts],
+                y=rounded(percentages[outcome]),
+                name=outcome,
+                stackgroup='one',
+                fillcolor=colors[i],
+                line=dict(width=0.5, color=colors[i]),
+                hovertemplate='%{y:.1f}%<extra></extra>'
+            ))
+
+    return fig
+
+
+def retention_bar_figure(depts, rates, totals, title):
+    """
+    Horizontal bar chart of retention rate per department
+    """
+    fig = go.Figure(layout=dict(template=bar_template, title=title))
+
+    fig.add_trace(go.Bar(
+        x=rounded(rates),
+        y=[d.title() for d in depts],
+        orientation='h',
+        text=[f"{v:.1f}%" for v in rates],
+        textposition='outside',
+        marker=dict(color='#2E86AB'),
+        hovertemplate=(
+            "<b>%{y}</b><br>"
+            "Retention: %{x:.1f}%<br>"
+            "Total students: %{customdata}<extra></extra>"
+        ),
+        customdata=[int(t) for t in totals]
+    ))
+
+    return fig
+
+
+def comparison_figure(cohorts, rates, title):
+    """
+    One retention line per group, overlaid on the same cohort axis
+
+    rates: dict of group label -> retention rates aligned with cohorts (None where no students)
+    """
+    fig = go.Figure(layout=dict(template=cohort_template, title=title))
+
+    for label, values in rates.items():
+        fig.add_trace(go.Scatter(
+            x=[int(c) for c in cohorts],
+            y=[None if v != v else round(float(v), precision) for v in values],
+            name=label,
+            mode='lines+markers',
+            hovertemplate='%{y:.1f}%<extra>%{fullData.name}</extra>'
+        ))
+
+    return fig
+
+
+def gap_heatmap_figure(cohorts, depts, gaps, title, colorbar_title):
+    """
+    Department x cohort heatmap of a retention gap, centred on zero
+
+    gaps: rows aligned with depts, columns aligned with cohorts (NaN where undefined)
+    """
+    z = [[None if v != v else round(float(v), precision) for v in row] for row in gaps]
+
+    fig = go.Figure(layout=dict(template=heatmap_template, title=title))
+
+    fig.add_trace(go.Heatmap(
+        x=[int(c) for c in cohorts],
+        y=[d.title() for d in depts],
+        z=z,
+        zmid=0,
+        colorscale='RdBu',
+        colorbar=dict(title=colorbar_title),
+        hovertemplate='%{y}, %{x}: %{z:.1f} points<extra></extra>'
+    ))
+
+    return fig
+
+
+def to_json(fig):
+    """
+    Serialize a figure the way st.plotly_chart does, to measure what gets sent
+    """
+    return pio.to_json(fig, validate=False)
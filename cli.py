@@ -0,0 +1,130 @@
+# Headless entry point for cron jobs and scripts.
+#
+#   python cli.py build                      # clean raw_data.csv into raw_data_cleaned.parquet
+#   python cli.py aggregates --urm URM       # department retention table as CSV
+#   python cli.py chart math -o math.html    # export one department's outcome chart
+#
+# Heavy libraries are imported inside the commands that use them. The common
+# commands read the prebuilt Parquet with pyarrow and never import pandas;
+# pandas is only loaded when the cleaned dataset has to be (re)built.
+import argparse
+import sys
+
+import pipeline
+
+urm_options = ['All', 'URM', 'Non-URM']
+student_options = ['All', 'Freshman', 'Transfer']
+
+
+def cell_sums(args, keys):
+    """
+    Sum headcount over the cleaned dataset grouped by the given columns
+
+    Returns a dict of key tuple -> headcount. Aggregation is done in Python over
+    record batches because pyarrow imports pandas as soon as Python values are
+    converted to Arrow (compute scalars, group_by options), which would double
+    the start-up time.
+    """
+    import pyarrow.parquet as pq
+
+    if not pipeline.is_fresh(args.raw, args.cleaned):
+        pipeline.build_cleaned(args.raw, args.cleaned)
+
+    sums = {}
+    # ParquetFile rather than pq.read_table: the latter goes through pyarrow.dataset, which imports pandas
+    for batch in pq.ParquetFile(args.cleaned).iter_batches(columns=[*keys, 'headcount']):
+        cols = batch.to_pydict()
+        for key, headcount in zip(zip(*(cols[k] for k in keys)), cols['headcount']):
+            sums[key] = sums.get(key, 0) + headcount
+    return sums
+
+
+def keep(urm, fresh, urm_status, student_type):
+    if urm_status != 'All' and urm != (urm_status == 'URM'):
+        return False
+    if student_type != 'All' and fresh != (student_type == 'Freshman'):
+        return False
+    return True
+
+
+def cmd_build(args):
+    df = pipeline.build_cleaned(args.raw, args.cleaned)
+    print(f"wrote {len(df)} rows to {args.cleaned}", file=sys.stderr)
+
+
+def cmd_aggregates(args):
+    sums = cell_sums(args, ['cohort', 'start_dept', 'urm', 'fresh', 'outcome'])
+
+    totals, retained = {}, {}
+    for (cohort, dept, urm, fresh, outcome), headcount in sums.items():
+        if dept is None or dept == 'undeclared' or not args.start <= cohort <= args.end:
+            continue
+        if not keep(urm, fresh, args.urm, args.type):
+            continue
+        totals[dept] = totals.get(dept, 0) + headcount
+        if outcome == 'retained':
+            retained[dept] = retained.get(dept, 0) + headcount
+
+    print('dept,retention_rate,total')
+    for dept in sorted(totals):
+        total = totals[dept]
+        retention_rate = (retained.get(dept, 0) / total * 100) if total > 0 else 0
+        print(f'"{dept}",{retention_rate:.1f},{total}')
+
+
+def cmd_chart(args):
+    sums = cell_sums(args, ['cohort', 'start_dept', 'urm', 'fresh', 'outcome_display'])
+
+    totals, counts = {}, {}
+    for (cohort, dept, urm, fresh, outcome), headcount in sums.items():
+        if dept != args.department or not keep(urm, fresh, args.urm, args.type):
+            continue
+        totals[cohort] = totals.get(cohort, 0) + headcount
+        counts[outcome, cohort] = counts.get((outcome, cohort), 0) + headcount
+    if not totals:
+        sys.exit(f"no students for department {args.department!r} with these filters")
+
+    cohorts = sorted(totals)
+    percentages = {
+        outcome: [counts.get((outcome, c), 0) / totals[c] * 100 for c in cohorts]
+        for outcome, _ in counts
+    }
+
+    import charts
+
+    title = charts.filter_title(f'Student Outcomes for {args.department.title()} Department', args.urm, args.type)
+    fig = charts.outcome_area_figure(cohorts, percentages, charts.dept_outcomes, title)
+    out = args.output or f"{args.department.replace(' ', '_')}.html"
+    fig.write_html(out, include_plotlyjs='cdn')
+    print(f"wrote {out}", file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="UCLA Physical Sciences retention pipeline")
+    parser.add_argument('--raw', default=pipeline.RAW_PATH, help="raw extract CSV")
+    parser.add_argument('--cleaned', help="prebuilt cleaned Parquet (default: <raw>_cleaned.parquet)")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    sub.add_parser('build', help="clean the raw extract into the Parquet cache").set_defaults(func=cmd_build)
+
+    agg = sub.add_parser('aggregates', help="print department retention rates as CSV")
+    agg.add_argument('--start', type=int, default=2010, help="first cohort (inclusive)")
+    agg.add_argument('--end', type=int, default=2020, help="last cohort (inclusive)")
+    agg.set_defaults(func=cmd_aggregates)
+
+    chart = sub.add_parser('chart', help="export one department's outcome chart as HTML")
+    chart.add_argument('department', help="department name, e.g. math")
+    chart.add_argument('-o', '--output', help="output file (default: <department>.html)")
+    chart.set_defaults(func=cmd_chart)
+
+    for p in (agg, chart):
+        p.add_argument('--urm', choices=urm_options, default='All')
+        p.add_argument('--type', choices=student_options, default='All')
+
+    args = parser.parse_args(argv)
+    args.cleaned = args.cleaned or pipeline.cleaned_path_for(args.raw)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+# Downloadable files for the dashboard's aggregates.
+#
+# The app hands st.download_button a callable, so nothing here runs until a
+# button is clicked. Per-tab tables are small and serialized straight from the
+# aggregates the app already holds. The full-campus export is written to disk
+# one department at a time, next to the cleaned dataset, and reused until that
+# dataset is rebuilt.
+#
+# This is not streaming to the browser: streamlit reads whatever the callable
+# returns into its in-memory media store before serving it, so the finished
+# file is held in memory once per click. Only building it is done in chunks.
+import io
+import os
+import threading
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import aggregates
+import pipeline
+
+formats = {
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+
+def to_bytes(df, fmt):
+    """
+    Serialize a table as CSV or Parquet
+    """
+    buf = io.BytesIO()
+    if fmt == 'csv':
+        df.to_csv(buf, index=False)
+    else:
+        df.to_parquet(buf, index=False)
+    return buf.getvalue()
+
+
+def campus_path_for(raw_path, fmt):
+    return os.path.splitext(raw_path)[0] + f'_campus.{fmt}'
+
+
+def campus_chunks(prefix):
+    """
+    Headcount per major, cell and cohort in long format, one department at a time
+
+    prefix: prefix sum table at major grain (rollups['major'])
+    Zero headcounts are left out.
+    """
+    for _, chunk in prefix.groupby(level='start_dept', dropna=False, sort=True):
+        chunk = aggregates.cohort_counts(chunk)
+        chunk = chunk.rename_axis(columns='cohort').stack().rename('headcount').reset_index()
+        yield chunk[chunk['headcount'] > 0]
+
+
+def write_campus(prefix, path, fmt):
+    """
+    Write campus_chunks to path chunk by chunk, replacing it atomically
+    """
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    writer = None
+    with open(tmp_path, 'wb') as f:
+        for i, chunk in enumerate(campus_chunks(prefix)):
+            if fmt == 'csv':
+                chunk.to_csv(f, index=False, header=i == 0)
+            else:
+                table = pa.Table.from_pandas(chunk, schema=writer.schema if writer else None, preserve_index=False)
+                writer = writer or pq.ParquetWriter(f, table.schema)
+                writer.write_table(table)
+        if writer:
+            writer.close()
+    os.replace(tmp_path, path)
+
+
+def campus_bytes(prefix, raw_path, fmt):
+    """
+    Contents of the full-campus export for raw_path, (re)writing it if the cleaned dataset is newer
+    """
+    path = campus_path_for(raw_path, fmt)
+    cleaned_path = pipeline.cleaned_path_for(raw_path)
+    if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(cleaned_path):
+        write_campus(prefix, path, fmt)
+    with open(path, 'rb') as f:
+        return f.read()
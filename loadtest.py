@@ -0,0 +1,197 @@
+# Offline load test for app.py.
+#
+#   python loadtest.py                          # 1, 2, 4 and 8 concurrent sessions
+#   python loadtest.py -c 1,16 --steps 50 --json loadtest.json
+#
+# Each session is a headless streamlit AppTest that runs the app once and then
+# makes a seeded random sequence of widget changes, rerunning after each one.
+# For every concurrency level it reports p50/p95/p99 rerun latency, reruns per
+# second and peak RSS summed over all sessions.
+#
+# AppTest swaps a global Runtime in and out around every run, so two AppTests
+# can't run on threads of one process. Each session therefore gets its own
+# process, warms its own st.cache_data, and waits on a barrier so all sessions
+# start rerunning together. This captures CPU contention between sessions but
+# not GIL contention inside a single streamlit server, so latencies are
+# optimistic for sessions sharing one server process.
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import psutil
+from streamlit.testing.v1 import AppTest
+
+import pipeline
+
+here = os.path.dirname(os.path.abspath(__file__))
+app_path = os.path.join(here, 'app.py')
+
+
+def random_change(at, rng):
+    """
+    Apply one widget change a user might make, chosen at random
+    """
+    action = rng.choice(['dept', 'major', 'urm', 'type', 'cohorts', 'compare'])
+    if action == 'dept':
+        box = at.selectbox(key='dept_tab1')
+        box.set_value(rng.choice(box.options))
+    elif action == 'major':
+        box = at.selectbox(key='major_tab1')
+        box.set_value(rng.choice(box.options))
+    elif action == 'urm':
+        box = at.selectbox(key=rng.choice(['urm_tab1', 'urm_tab2']))
+        box.set_value(rng.choice(box.options))
+    elif action == 'type':
+        box = at.selectbox(key=rng.choice(['student_tab1', 'student_tab2']))
+        box.set_value(rng.choice(box.options))
+    elif action == 'cohorts':
+        slider = at.slider(key='cohort_range')
+        start, end = sorted(rng.sample(range(int(slider.proto.min), int(slider.proto.max) + 1), 2))
+        slider.set_range(start, end)
+    else:
+        depts = at.multiselect(key='depts_tab4')
+        depts.set_value(rng.sample(depts.options, rng.randint(1, len(depts.options))))
+
+
+def setup():
+    # The app reads its data relative to the working directory
+    os.chdir(here)
+    if here not in sys.path:
+        sys.path.insert(0, here)
+    logging.getLogger('streamlit').setLevel(logging.ERROR)
+    # Every session is its own process; none of them should claim the metrics port
+    os.environ['METRICS_PORT'] = ''
+
+
+def run_session(seed, steps, timeout, barrier=None):
+    """
+    Run one session and return its rerun latencies in seconds
+
+    The first run loads the caches and is not timed. If it fails the barrier
+    is aborted, so the other sessions and the parent stop waiting.
+    """
+    setup()
+    rng = random.Random(seed)
+    try:
+        at = AppTest.from_file(app_path, default_timeout=timeout)
+        at.run()
+        if at.exception:
+            raise RuntimeError(f"session {seed} failed on load: {at.exception[0].message}")
+    except BaseException:
+        if barrier is not None:
+            barrier.abort()
+        raise
+    if barrier is not None:
+        barrier.wait(timeout=timeout * 2)
+
+    latencies = []
+    for step in range(steps):
+        random_change(at, rng)
+        start = time.perf_counter()
+        at.run()
+        latencies.append(time.perf_counter() - start)
+        if at.exception:
+            raise RuntimeError(f"session {seed} failed at step {step}: {at.exception[0].message}")
+    return latencies
+
+
+def total_rss(process):
+    rss = process.memory_info().rss
+    for child in process.children(recursive=True):
+        try:
+            rss += child.memory_info().rss
+        except psutil.NoSuchProcess:
+            pass
+    return rss
+
+
+def run_level(concurrency, steps, seed, timeout):
+    """
+    Run concurrency sessions at once and summarize their reruns
+    """
+    process = psutil.Process()
+    peak_rss = total_rss(process)
+    done = threading.Event()
+
+    def sample_memory():
+        nonlocal peak_rss
+        while not done.wait(0.05):
+            peak_rss = max(peak_rss, total_rss(process))
+
+    sampler = threading.Thread(target=sample_memory, daemon=True)
+    sampler.start()
+
+    with multiprocessing.Manager() as manager, ProcessPoolExecutor(max_workers=concurrency) as pool:
+        barrier = manager.Barrier(concurrency + 1)
+        sessions = [pool.submit(run_session, seed + i, steps, timeout, barrier) for i in range(concurrency)]
+        try:
+            barrier.wait(timeout=timeout * 2)
+        except threading.BrokenBarrierError:
+            # Wait for the sessions to wind down and report the first real failure
+            errors = [e for e in (session.exception() for session in sessions) if not isinstance(e, threading.BrokenBarrierError)]
+            done.set()
+            if errors:
+                raise RuntimeError(errors[0]) from errors[0]
+            raise RuntimeError(f"{concurrency} sessions did not all load within {timeout * 2:g}s")
+        start = time.perf_counter()
+        latencies = [latency for session in sessions for latency in session.result()]
+        elapsed = time.perf_counter() - start
+
+    done.set()
+    sampler.join()
+
+    cuts = statistics.quantiles(latencies, n=100, method='inclusive')
+    return {
+        'concurrency': concurrency,
+        'reruns': len(latencies),
+        'p50_ms': cuts[49] * 1000,
+        'p95_ms': cuts[94] * 1000,
+        'p99_ms': cuts[98] * 1000,
+        'reruns_per_s': len(latencies) / elapsed,
+        'peak_rss_mb': peak_rss / 2**20,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Concurrent headless load test for app.py")
+    parser.add_argument('-c', '--concurrency', default='1,2,4,8', help="comma separated session counts (default: 1,2,4,8)")
+    parser.add_argument('--steps', type=int, default=20, help="widget changes per session (default: 20)")
+    parser.add_argument('--seed', type=int, default=0, help="seed for the widget change sequences (default: 0)")
+    parser.add_argument('--timeout', type=float, default=60, help="seconds allowed per rerun (default: 60)")
+    parser.add_argument('--json', help="also write the results to this file")
+    parser.add_argument('--max-p95-ms', type=float, help="exit with status 1 if any level's p95 exceeds this")
+    args = parser.parse_args(argv)
+
+    setup()
+
+    # Build the cleaned datasets up front so sessions don't all rebuild them
+    pipeline.build_stale(pipeline.discover_raw())
+
+    results = []
+    print(f"{'sessions':>8} {'reruns':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'reruns/s':>9} {'peak MB':>8}")
+    for concurrency in [int(c) for c in args.concurrency.split(',')]:
+        try:
+            r = run_level(concurrency, args.steps, args.seed, args.timeout)
+        except RuntimeError as e:
+            sys.exit(f"loadtest failed: {e}")
+        results.append(r)
+        print(f"{r['concurrency']:>8} {r['reruns']:>7} {r['p50_ms']:>8.0f} {r['p95_ms']:>8.0f} {r['p99_ms']:>8.0f} {r['reruns_per_s']:>9.1f} {r['peak_rss_mb']:>8.0f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.max_p95_ms is not None and any(r['p95_ms'] > args.max_p95_ms for r in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
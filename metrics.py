@@ -0,0 +1,113 @@
+# Prometheus metrics for the dashboard, served on a local port.
+#
+#   METRICS_PORT=9464 streamlit run app.py     # scrape http://127.0.0.1:9464/metrics
+#   METRICS_PORT= streamlit run app.py         # no metrics server
+#
+# Collectors and the server are created through st.cache_resource, so they
+# exist once per process and are shared by every session. Streamlit re-imports
+# a local module after it changes on disk; the re-imported module gets the
+# same collectors back instead of registering duplicates. The CLI doesn't
+# import this module, which keeps prometheus_client out of its startup time.
+import os
+import threading
+import warnings
+
+import psutil
+import streamlit as st
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+
+@st.cache_resource
+def collector(name, _make):
+    # Keyed by name only: _make is not hashed, so edits to a metric's definition don't re-register it
+    return _make()
+
+
+load_seconds = collector('retention_load_data_seconds', lambda: Histogram(
+    'retention_load_data_seconds',
+    "Time spent loading a dataset, by stage",
+    ['stage'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+))
+tab_seconds = collector('retention_tab_build_seconds', lambda: Histogram(
+    'retention_tab_build_seconds',
+    "Time spent recomputing a tab's aggregates or figures on a rerun",
+    ['tab', 'kind'],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1),
+))
+rerun_seconds = collector('retention_rerun_seconds', lambda: Histogram(
+    'retention_rerun_seconds',
+    "Time taken by a full run of app.py",
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+))
+cache_hits = collector('retention_cache_hits_total', lambda: Counter(
+    'retention_cache_hits_total', "Lookups answered from a cache", ['cache']))
+cache_misses = collector('retention_cache_misses_total', lambda: Counter(
+    'retention_cache_misses_total', "Lookups that had to compute their value", ['cache']))
+dataset_rows = collector('retention_dataset_rows', lambda: Gauge(
+    'retention_dataset_rows', "Rows in a cleaned dataset", ['dataset']))
+resident_memory = collector('retention_resident_memory_bytes', lambda: Gauge(
+    'retention_resident_memory_bytes', "Resident memory of the dashboard process"))
+
+resident_memory.set_function(lambda: psutil.Process().memory_info().rss)
+
+_missed = threading.local()
+
+
+def observe_stage(stage, seconds):
+    """
+    pipeline.stage_listeners entry; app.py sets it on every run
+    """
+    load_seconds.labels(stage).observe(seconds)
+
+
+@st.cache_resource
+def serve(port=None, addr='127.0.0.1'):
+    """
+    Start the metrics server once per process, on METRICS_PORT (default 9464)
+
+    An empty METRICS_PORT disables it. If the port is taken (e.g. by another
+    dashboard process) a warning is issued and the app runs without it.
+    """
+    port = os.environ.get('METRICS_PORT', '9464') if port is None else port
+    if port == '':
+        return
+    try:
+        start_http_server(int(port), addr=addr)
+    except OSError as e:
+        warnings.warn(f"metrics server not started on {addr}:{port}: {e}")
+
+
+def record_miss(cache):
+    """
+    Call from inside a cached function's body, which only runs on a miss
+    """
+    cache_misses.labels(cache).inc()
+    _missed.names = getattr(_missed, 'names', set()) | {cache}
+
+
+def cached_call(cache, fn, *args):
+    """
+    Call a cached function, counting a hit unless its body called record_miss
+    """
+    names = getattr(_missed, 'names', set())
+    names.discard(cache)
+    _missed.names = names
+    value = fn(*args)
+    if cache not in _missed.names:
+        cache_hits.labels(cache).inc()
+    return value
+
+
+def observe_graph(graph, node_tabs):
+    """
+    Record a rerun's reactive graph: reused nodes as hits, recomputed nodes as
+    misses with their build time under the (tab, kind) given in node_tabs
+    """
+    for name in graph.values:
+        if name in graph.durations:
+            cache_misses.labels('graph').inc()
+            tab, kind = node_tabs.get(name, ('other', 'aggregation'))
+            tab_seconds.labels(tab, kind).observe(graph.durations[name])
+        else:
+            cache_hits.labels('graph').inc()
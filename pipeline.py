@@ -0,0 +1,313 @@
+# Data loading and cleaning shared by app.py and cli.py.
+# pandas is imported inside the functions that need it so that importing this
+# module (e.g. for the paths and mappings) stays cheap for the CLI.
+import contextlib
+import functools
+import glob
+import os
+import threading
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
+RAW_PATH = "raw_data.csv"
+# Further extracts (other vintages or divisions) can be dropped in here
+DATA_DIR = "data"
+
+raw_columns = ['cohort', 'urm', 'freshman_transfer', 'cohort_major_desc', 'deg_major_desc', 'headcount']
+
+maj2dept = {
+    'atmospheric and oceanic sciences': 'aos',
+    'climate science': 'aos',
+    'aos/math': 'aos',
+    'biochemistry': 'chemistry and biochemistry',
+    'chemistry': 'chemistry and biochemistry',
+    'materials science': 'chemistry and biochemistry',
+    'gen chem for teaching': 'chemistry and biochemistry',
+    'geology': 'epss',
+    'engineering geology': 'epss',
+    'geophysics': 'epss',
+    'earth and environmental science': 'epss',
+    'mathematics': 'math',
+    'applied mathematics': 'math',
+    'financial actuarial mathematics': 'math',
+    'mathematics applied science': 'math',
+    'mathematics of computation': 'math',
+    'mathematics for teaching': 'math',
+    'mathematics/economics': 'math',
+    'astrophysics': 'physics and astronomy',
+    'biophysics': 'physics and astronomy',
+    'physics': 'physics and astronomy',
+    'physics-ba': 'physics and astronomy',
+    'statistics and data science': 'statistics',
+    'data theory': 'statistics',
+    'environmental science': 'institute of environment and sustainability',
+}
+
+phys_sci_depts = set(maj2dept.values())
+dept2div = dict.fromkeys([*phys_sci_depts, 'undeclared'], 'physical sciences')
+
+special_cases = {'no degree': 'no degree', 'undeclared': 'undeclared'}
+maj2dept_and_friends = maj2dept | special_cases
+
+# name -> listener(stage, seconds), called after each timed stage of loading a
+# dataset (parse, clean, write, read). Keyed so that setting one again, e.g.
+# after its module was reloaded, replaces it instead of adding a second
+stage_listeners = {}
+
+
+@contextlib.contextmanager
+def timed(stage):
+    start = time.perf_counter()
+    yield
+    seconds = time.perf_counter() - start
+    for listener in list(stage_listeners.values()):
+        listener(stage, seconds)
+
+
+outcome2display = {
+    'retained': 'Stayed in Department',
+    'other degree': 'Other Department',
+    'no degree': 'No Degree',
+}
+
+
+def clean(df):
+    """
+    Clean the validated extract from read_raw and expand double majors into one row per major pair
+    """
+    import numpy as np
+
+    df = df.rename(columns={'cohort_major_desc': 'start_maj', 'deg_major_desc': 'end_maj', 'freshman_transfer': 'fresh'})
+    df['cohort'] = df['cohort'].str[:4].astype(int)
+    df['urm'] = df['urm'].map({'urm': True, 'non-urm': False})
+    df['fresh'] = df['fresh'].map({'freshman': True, 'transfer': False})
+    df['start_maj'] = df['start_maj'] \
+        .replace('general chemistry', 'chemistry') \
+        .replace('undeclared-physical science', 'undeclared') \
+        .replace('mathematics/applied science', 'mathematics applied science') # get rid of slash so it isnt treated like a double major
+
+    df['end_maj'] = df['end_maj'] \
+        .replace('mathematics/applied science', 'mathematics applied science')
+
+    # Track depts
+    df['start_dept'] = df['start_maj'].map(maj2dept_and_friends)
+    df['end_dept'] = df['end_maj'].map(maj2dept_and_friends).fillna('other')
+    df['start_div'] = df['start_dept'].map(dept2div)
+
+    df['outcome'] = np.select(
+        [df['end_dept'] == 'no degree', df['end_dept'] == df['start_dept']],
+        ['no degree', 'retained'],
+        'other degree',
+    )
+    df['outcome_display'] = df['outcome'].map(outcome2display)
+    # Outcome relative to the whole division, used for undeclared students
+    df['division_outcome'] = np.select(
+        [df['end_dept'] == 'no degree', df['end_dept'].isin(phys_sci_depts)],
+        ['No Degree', 'Stayed in Physical Sciences'],
+        'Other Degree',
+    )
+
+    # Expand double majors. Depts and outcomes stay those of the original row.
+    # Slashed names that are single majors in maj2dept (e.g. mathematics/economics) are kept whole.
+    df = df.assign(start_maj=split_majors(df['start_maj'])).explode('start_maj')
+    df = df.assign(end_maj=split_majors(df['end_maj'])).explode('end_maj')
+    df['start_maj'] = df['start_maj'].str.strip()
+    df['end_maj'] = df['end_maj'].str.strip()
+
+    # One row per original row is primary, so division and campus totals can count each student once
+    df['primary'] = ~df.index.duplicated()
+
+    return df.reset_index(drop=True)
+
+
+def split_majors(majors):
+    """
+    Split double majors on '/', leaving single majors that contain a slash alone
+    """
+    return majors.str.split('/').where(~majors.isin(maj2dept), majors.map(lambda m: [m]))
+
+
+def quarantine_path_for(raw_path):
+    return os.path.splitext(raw_path)[0] + '_quarantine.csv'
+
+
+def cleaned_path_for(raw_path):
+    return os.path.splitext(raw_path)[0] + '_cleaned.parquet'
+
+
+CLEANED_PATH = cleaned_path_for(RAW_PATH)
+
+
+def dataset_name(raw_path):
+    return os.path.splitext(os.path.basename(raw_path))[0]
+
+
+def discover_raw(data_dir=DATA_DIR):
+    """
+    Raw extracts available: raw_data.csv plus any CSVs in data_dir
+    """
+    paths = [RAW_PATH] if os.path.exists(RAW_PATH) else []
+    paths += sorted(p for p in glob.glob(os.path.join(data_dir, '*.csv')) if not p.endswith(('_quarantine.csv', '_campus.csv')))
+    return paths
+
+
+def read_raw(path=RAW_PATH, quarantine_path=None):
+    """
+    Parse the raw extract with pyarrow's multithreaded CSV reader and validate it
+
+    Text fields are trimmed and lowercased in Arrow before pandas sees them.
+    Rows failing any check are dropped and written with their reasons to
+    quarantine_path (default: <raw>_quarantine.csv).
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pacsv
+
+    table = pacsv.read_csv(
+        path,
+        read_options=pacsv.ReadOptions(use_threads=True),
+        convert_options=pacsv.ConvertOptions(
+            include_columns=raw_columns,
+            column_types=dict.fromkeys(raw_columns, pa.string()),
+            strings_can_be_null=True,
+        ),
+    )
+
+    # Trim the padded fields and normalize case, keeping the original for the quarantine file
+    raw = table
+    for col in raw_columns:
+        values = pc.utf8_trim_whitespace(table[col])
+        if col in ('urm', 'freshman_transfer', 'cohort_major_desc', 'deg_major_desc'):
+            values = pc.utf8_lower(values)
+        table = table.set_column(table.schema.get_field_index(col), col, values)
+
+    # Vectorized checks: True where the row is fine, nulls count as failures
+    checks = {
+        'malformed cohort': pc.match_substring_regex(table['cohort'], r'^\d{4}-\d{2}$'),
+        'unknown urm': pc.is_in(table['urm'], value_set=pa.array(['urm', 'non-urm'])),
+        'unknown freshman_transfer': pc.is_in(table['freshman_transfer'], value_set=pa.array(['freshman', 'transfer'])),
+        'missing cohort_major_desc': pc.greater(pc.utf8_length(table['cohort_major_desc']), 0),
+        'missing deg_major_desc': pc.greater(pc.utf8_length(table['deg_major_desc']), 0),
+        'malformed headcount': pc.match_substring_regex(table['headcount'], r'^-?\d+$'),
+        'negative headcount': pc.invert(pc.fill_null(pc.starts_with(table['headcount'], '-'), False)),
+    }
+    checks = {reason: pc.fill_null(ok, False) for reason, ok in checks.items()}
+    valid = functools.reduce(pc.and_, checks.values())
+
+    quarantine_path = quarantine_path or quarantine_path_for(path)
+    invalid = pc.invert(valid)
+    rejected = raw.filter(invalid)
+    if rejected.num_rows:
+        reasons = [pc.if_else(ok.filter(invalid), None, reason) for reason, ok in checks.items()]
+        reason = pc.binary_join_element_wise(*reasons, '; ', null_handling='skip')
+        # Write then rename, as sessions may rebuild the same extract at once
+        tmp_path = f"{quarantine_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        pacsv.write_csv(rejected.append_column('reason', reason), tmp_path)
+        os.replace(tmp_path, quarantine_path)
+        warnings.warn(f"{rejected.num_rows} invalid rows in {path} written to {quarantine_path}")
+    else:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(quarantine_path)
+
+    table = table.filter(valid)
+    table = table.set_column(table.schema.get_field_index('headcount'), 'headcount', pc.cast(table['headcount'], pa.int64()))
+    return table.to_pandas()
+
+
+def build_cleaned(raw_path=RAW_PATH, cleaned_path=None):
+    """
+    Clean the raw extract and write it to cleaned_path (default: <raw>_cleaned.parquet)
+    """
+    cleaned_path = cleaned_path or cleaned_path_for(raw_path)
+    with timed('parse'):
+        raw = read_raw(raw_path)
+    with timed('clean'):
+        df = clean(raw)
+    # Write then rename, so concurrent readers never see a partial file
+    with timed('write'):
+        tmp_path = f"{cleaned_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, cleaned_path)
+    return df
+
+
+# raw_path -> (mtime, exception) for extracts that failed to build, so a bad
+# extract isn't reparsed on every rerun until it changes
+build_failures = {}
+
+
+def build_stale(raw_paths, max_workers=None):
+    """
+    Rebuild the cleaned dataset of every extract that needs it, concurrently
+
+    Parsing happens in pyarrow, which releases the GIL, so a thread pool
+    overlaps the extracts. One extract failing doesn't stop the others.
+    Returns {raw_path: exception} for the extracts that could not be built.
+    """
+    failed = {}
+    stale = []
+    for path in raw_paths:
+        if is_fresh(path):
+            continue
+        mtime, error = build_failures.get(path, (None, None))
+        if mtime == os.path.getmtime(path):
+            failed[path] = error
+        else:
+            stale.append(path)
+
+    if stale:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = {path: pool.submit(build_cleaned, path) for path in stale}
+        for path, future in futures.items():
+            if future.exception() is None:
+                build_failures.pop(path, None)
+            else:
+                failed[path] = future.exception()
+                build_failures[path] = (os.path.getmtime(path), future.exception())
+    return failed
+
+
+def check_cleaned(raw_path, cleaned_path=None):
+    """
+    Why the cleaned dataset can't be shown in the app, or None if it can
+
+    The app needs at least one row and one department besides undeclared.
+    Only the start_dept column is read.
+    """
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    depts = pq.read_table(cleaned_path or cleaned_path_for(raw_path), columns=['start_dept'])['start_dept']
+    if len(depts) == 0:
+        return "no valid rows"
+    if not set(pc.unique(depts.drop_null()).to_pylist()) - {'undeclared'}:
+        return "no physical sciences departments"
+    return None
+
+
+def is_fresh(raw_path=RAW_PATH, cleaned_path=None):
+    """
+    True if cleaned_path exists and is at least as new as raw_path and this module
+    """
+    cleaned_path = cleaned_path or cleaned_path_for(raw_path)
+    if not os.path.exists(cleaned_path):
+        return False
+    if os.path.getmtime(cleaned_path) < os.path.getmtime(__file__):
+        return False
+    if not os.path.exists(raw_path):
+        return True
+    return os.path.getmtime(cleaned_path) >= os.path.getmtime(raw_path)
+
+
+def load_cleaned(raw_path=RAW_PATH, cleaned_path=None):
+    """
+    Read the prebuilt cleaned dataset, rebuilding it first if it is missing or stale
+    """
+    import pandas as pd
+
+    cleaned_path = cleaned_path or cleaned_path_for(raw_path)
+    if is_fresh(raw_path, cleaned_path):
+        with timed('read'):
+            return pd.read_parquet(cleaned_path)
+    return build_cleaned(raw_path, cleaned_path)
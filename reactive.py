@@ -0,0 +1,63 @@
+# Small dependency graph for the dashboard's computations.
+#
+# Streamlit reruns the whole script on every widget change. Each computation is
+# declared as a node together with the widget keys and the other nodes it reads.
+# A node's key is the current value of those widgets plus the keys of its
+# dependencies; when the key matches the one stored from the previous rerun the
+# stored result is reused, otherwise the node is recomputed. Results live in
+# session-scoped storage (normally st.session_state), so each user session
+# keeps its own.
+import time
+
+
+class Graph:
+    """
+    Nodes are registered with the node decorator and read with graph['name']
+
+    state: widget values, normally st.session_state
+    data_key: identifies the data the nodes close over; stored results are
+        dropped when it changes
+    """
+
+    def __init__(self, state, data_key=None, store_key='reactive_results'):
+        self.state = state
+        if store_key not in state or state[store_key]['data_key'] != data_key:
+            state[store_key] = {'data_key': data_key, 'results': {}}
+        self.store = state[store_key]['results']
+        self.nodes = {}
+        self.keys = {}
+        self.values = {}
+        self.recomputed = []
+        # Seconds spent in each recomputed node's own function, excluding its dependencies
+        self.durations = {}
+
+    def node(self, widgets=(), deps=()):
+        """
+        Register a node. The function gets each widget value and each dependency
+        result as a keyword argument named after it.
+        """
+        def register(fn):
+            self.nodes[fn.__name__] = (fn, tuple(widgets), tuple(deps))
+            return fn
+        return register
+
+    def __getitem__(self, name):
+        if name not in self.values:
+            fn, widgets, deps = self.nodes[name]
+            inputs = {w: self.state.get(w) for w in widgets}
+            inputs |= {d: self[d] for d in deps}
+            key = (tuple(inputs[w] for w in widgets), tuple(self.keys[d] for d in deps))
+
+            stored = self.store.get(name)
+            if stored is not None and stored[0] == key:
+                value = stored[1]
+            else:
+                start = time.perf_counter()
+                value = fn(**inputs)
+                self.durations[name] = time.perf_counter() - start
+                self.store[name] = (key, value)
+                self.recomputed.append(name)
+
+            self.keys[name] = key
+            self.values[name] = value
+        return self.values[name]